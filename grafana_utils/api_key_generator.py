@@ -4,7 +4,7 @@ Grafana API key generator
 This script allows the user to generate an API key to the specified api_key_file location.
 The api key requires an organization to be created and associated with the API Key.
 
-The scripts names the API key the org name with '_apikey' appended to the end.
+The scripts names the API key after the org name.
 
 A key will not be generated if one already exists at the provided file path (-f --file)
 and the key name matches the provided org name else the script will attempt to generate
@@ -34,19 +34,56 @@ Arguments:
 
     -o --org        Organization name API will be generated for
                     Default: trusted
+
+    --pretty        Indent the api key file for human reading
+                    Default: compact json
+
+Environment:
+    GRAFANA_POOL_SIZE   Number of pooled connections kept to the grafana server
+                        Default: 4 (also used when the value is invalid)
 """
 
 from sys import exit, argv
+from argparse import ArgumentParser, Namespace
+from os import environ
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import requests
 import json
 
+try:
+    import orjson  # type: ignore[import-not-found]
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+
+def pool_size(default:int=4) -> int:
+    """Returns GRAFANA_POOL_SIZE if it is a positive integer else default"""
+    try:
+        size = int(environ.get('GRAFANA_POOL_SIZE', default))
+    except ValueError:
+        return default
+    return size if size > 0 else default
+
+
+POOL_SIZE = pool_size()
+
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE,
+                       max_retries=Retry(total=3, backoff_factor=0.2,
+                                         status_forcelist=[502, 503, 504]))
+_session.mount('http://', _adapter)
+_session.mount('https://', _adapter)
+
 
 class MissingArgumentError(Exception):
     """Exception raised for missing arguments"""
 
-    def __init__(self, argument_list:list):
-        self.message = f'Missing argument! {argument_list=}!'
+    def __init__(self, argument:str):
+        self.message = f'Missing argument! {argument=}!'
         super().__init__(self.message)
 
 
@@ -75,13 +112,44 @@ class OrganizationError(Exception):
         super().__init__(self.message)
 
 
+def json_loads(content:bytes) -> Any:
+    """Returns parsed json content, using orjson when it is installed"""
+    if orjson:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
 def help_() -> None:
     """Simply print help text"""
     print(help_text)
 
 
-def check_arguments(name:str, user:str, password:str, 
-                    host:str, port:int, api_key_file:Path) -> None:
+def parse_arguments(args:list) -> Namespace:
+    """
+    Returns parsed command line arguments with defaults applied
+
+        Parameters:
+            args (list): Command line arguments excluding the program name
+
+        Returns:
+            arguments (Namespace): Parsed arguments, exits on unknown arguments
+    """
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument('-h', '--help', action='store_true')
+    parser.add_argument('-f', '--file', type=Path, default=None)
+    parser.add_argument('-H', '--host', default='localhost')
+    parser.add_argument('-P', '--port', type=int, default=3000)
+    parser.add_argument('-u', '--user', default='admin')
+    parser.add_argument('-p', '--pass', dest='password', default='admin')
+    parser.add_argument('-o', '--org', '-n', '--name', dest='name',
+                        default='trusted')
+    parser.add_argument('--pretty', action='store_true')
+    return parser.parse_args(args)
+
+
+def check_arguments(name:Optional[str], user:Optional[str],
+                    password:Optional[str], host:Optional[str],
+                    port:Optional[int], api_key_file:Optional[Path]) -> None:
     """
     Returns None if arguments are holding values else raises 
         MissingArgumentError exception
@@ -92,19 +160,23 @@ def check_arguments(name:str, user:str, password:str,
             password (str): Password for the grafana user
             host (str): Host for the grafana server
             port (int): Port for the grafana server
+            api_key_file (Path): Path leading to the file storing the API key
         
         Returns:
             None: no issues found and arguments are populated
             MissingArgumentError exception if arguments are None
     """
-    argument_list = [ name, user, password, host, host, port, api_key_file ]
-    index = 0
-    for argument in argument_list:
-        var = [key for key, value in locals().items() if value == argument]
-        if isinstance(argument, type(None)):
-            raise MissingArgumentError(var)
-
-        index += 1
+    arguments = (
+        ('name', name),
+        ('user', user),
+        ('password', password),
+        ('host', host),
+        ('port', port),
+        ('api_key_file', api_key_file),
+    )
+    for argument, value in arguments:
+        if value is None:
+            raise MissingArgumentError(argument)
 
 
 def check_api_key_file(name:str, api_key_file:Path) -> bool:
@@ -120,156 +192,215 @@ def check_api_key_file(name:str, api_key_file:Path) -> bool:
             False: api key is missing or associated name is different
     """
     if api_key_file.exists():
-        with open(api_key_file, 'r') as file:
-            try:
-                data = json.load(file)
-            except json.decoder.JSONDecodeError:
-                data = {}
-            if "key" in data and "name" in data:
-                if data['name'] == f'{name}':
-                    return True
+        try:
+            data = json_loads(api_key_file.read_bytes())
+        except json.decoder.JSONDecodeError:
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+        if data.get('name') == name and data.get('key'):
+            return True
     return False
 
 
-def create_api_token(name:str, user:str, password:str, 
-                     host:str, port:int) -> dict:
+def write_api_key_file(api_key:dict, api_key_file:Path,
+                       pretty:bool=False) -> None:
+    """
+    Writes the api key to api_key_file as json with sorted keys
+
+        Parameters:
+            api_key (dict): API key with keys, 'id', 'key', and 'name'
+            api_key_file (Path): Path leading to the file storing the API key
+            pretty (bool): Indent the json instead of writing it compact
+    """
+    if orjson:
+        option = orjson.OPT_SORT_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        api_key_file.write_bytes(orjson.dumps(api_key, option=option))
+    else:
+        with api_key_file.open('w') as file:
+            if pretty:
+                json.dump(api_key, file, sort_keys=True, indent=2)
+            else:
+                json.dump(api_key, file, sort_keys=True,
+                          separators=(',', ':'))
+
+
+def create_api_token(name:str, base_url:str,
+                     auth:tuple[str, str]) -> Optional[dict]:
     """
     Returns API token generated using the provided org_id
 
         Parameters:
             name (str): Name for the apikey
-            user (str): User for grafana (typically admin)
-            password (str): Password for the grafana user
-            host (str): Host for the grafana server
-            port (int): Port for the grafana server
+            base_url (str): Base url of the grafana server
+            auth (tuple): User and password for grafana (typically admin)
         Returns:
             key (dict): API key generated with keys, 'id', 'key', and 'name'
             None: If there was an issue generating API key
     """
 
     json_data = {
-        'name': f'{name}',
+        'name': name,
         'role': 'Admin',
     }
 
-    access = f'http://{user}:{password}@{host}:{port}'
-    url = access + '/api/auth/keys'
+    response = _session.post(f'{base_url}/api/auth/keys', json=json_data,
+                             auth=auth)
 
-    response = requests.post(url, json=json_data)
+    data = json_loads(response.content)
 
-    data = json.loads(str(response.content, 'utf-8'))
+    message = data.get('message')
+    if message:
+        raise CreateAPITokenError(message)
 
-    if "message" in data:
-        raise CreateAPITokenError(data['message'])
-
-    if "key" in data:
+    if data.get('key'):
         return data
 
+    return None
+
+
+def get_orgs(base_url:str, auth:tuple[str, str]) -> dict[str, int]:
+    """
+    Returns mapping of organization names to ids
+
+        Parameters:
+            base_url (str): Base url of the grafana server
+            auth (tuple): User and password for grafana (typically admin)
+        Returns:
+            orgs (dict): Organization ids keyed by organization name
+    """
+
+    response = _session.get(f'{base_url}/api/orgs', auth=auth)
+
+    data = json_loads(response.content)
+
+    return {org['name']: int(org['id']) for org in data}
+
 
-def post_org(name:str, user:str, password:str, host:str, port:int) -> int:
+def post_org(name:str, base_url:str,
+             auth:tuple[str, str]) -> Optional[int]:
     '''
     Returns integer of orgId if the org was created successfully
 
         Parameters:
             name (str): Name for the new organization
-            user (str): User for grafana (typically admin)
-            password (str): Password for the grafana user
-            host (str): Host for the grafana server
-            port (int): Port for the grafana server
+            base_url (str): Base url of the grafana server
+            auth (tuple): User and password for grafana (typically admin)
         Returns:
             orgid (int): Id of the organization created or found
             None: If there was an issue creating the org
     '''
 
     json_data = {
-        'name': f'{name}',
+        'name': name,
     }
 
-    access = f'http://{user}:{password}@{host}:{port}'
-    url = access + '/api/orgs'
-    
-    response = requests.post(url, json=json_data)
-
-    data = json.loads(str(response.content, 'utf-8'))
-    
-    if data['message'] == 'Organization name taken':
-        url = access + '/api/orgs'
+    # The org listing is always fetched alongside the create, one extra
+    # request on the common path, so the name taken path needs no second
+    # round trip
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        post_future = executor.submit(_session.post, f'{base_url}/api/orgs',
+                                      json=json_data, auth=auth)
+        get_future = executor.submit(get_orgs, base_url, auth)
 
-        response = requests.get(url)
+        response = post_future.result()
 
-        data = json.loads(str(response.content, 'utf-8'))
+        data = json_loads(response.content)
+        message = data.get('message')
 
-        for org in data:
-            if org['name'] == f'{name}':
-                return int(org['id'])
-        return None
+        if message == 'Organization name taken':
+            return get_future.result().get(name)
 
-    if data['message'] == 'Organization created':
+    if message == 'Organization created':
         return int(data['orgId'])
 
-    if data['message'] == 'invalid username or password':
-        raise InvalidUsernameOrPasswordError(data['message'])
+    if message == 'invalid username or password':
+        raise InvalidUsernameOrPasswordError(message)
+
+    return None
 
 
-def switch_org(org_id:int, user:str, password:str, host:str, port:int) -> None:
+def switch_org(org_id:int, base_url:str, auth:tuple[str, str]) -> None:
     """
     Returns none if successful in switching provided user to organization
 
         Parameters:
             org_id (str): Id for the organization
-            user (str): User for grafana (typically admin)
-            password (str): Password for the grafana user
-            host (str): Host for the grafana server
-            port (int): Port for the grafana server
+            base_url (str): Base url of the grafana server
+            auth (tuple): User and password for grafana (typically admin)
+    """
+
+    headers = {
+        'Accept': 'application/json',
+    }
+
+    response = _session.post(f'{base_url}/api/user/using/{org_id}',
+                             headers=headers, auth=auth)
+
+    # The status code is enough on success, the body is only read for errors
+    if response.ok:
+        return
+
+    try:
+        message = json_loads(response.content)['message']
+    except (json.decoder.JSONDecodeError, KeyError, TypeError):
+        message = 'Message response missing!'
+
+    raise OrganizationError(message)
+
+
+def provision_api_key(name:str, key_name:str,
+                      base_url:str, auth:tuple[str, str]) -> Optional[dict]:
     """
+    Returns API token generated for the named organization, creating the
+    organization and switching the user to it first
 
-    access = f'http://{user}:{password}@{host}:{port}'
-    url = access + '/api/user/using/' + str(org_id)
-    
-    response = requests.post(url)
-
-    data = json.loads(str(response.content, 'utf-8'))
-
-    if (not "message" in data or 
-        not data['message'] == 'Active organization changed'):
-
-        raise OrganizationError('Message response missing!')
-
-
-def main(args):
-    GRAFANA_NAME = 'trusted'
-    GRAFANA_USER = 'admin'
-    GRAFANA_PASS = 'admin'
-    GRFANA_HOST = 'localhost'
-    GRAFANA_PORT = 3000
-    API_KEY_FILE = None
-
-    while args:
-        current_argument = args[0]
-        if current_argument in ('-h', '--help'):
-            print('help_()')
-            exit(0)
-        if current_argument in ('-H', '--host'):
-            GRFANA_HOST = args[1]
-        if current_argument in ('-P', '--port'):
-            GRAFANA_PORT = args[1]
-        if current_argument in ('-u', '--user'):
-            GRAFANA_USER = args[1]
-        if current_argument in ('-p', '--pass'):
-            GRAFANA_PASS = args[1]
-        if current_argument in ('-n', '--name'):
-            GRAFANA_NAME = args[1]
-        if current_argument in ('-f', '--file'):
-            API_KEY_FILE = Path(args[1])
-        del args[0]
+    The steps run back to back over the shared keep-alive session, so the
+    connection to grafana is only set up once.
+
+        Parameters:
+            name (str): Name for the organization
+            key_name (str): Name for the apikey
+            base_url (str): Base url of the grafana server
+            auth (tuple): User and password for grafana (typically admin)
+        Returns:
+            key (dict): API key generated with keys, 'id', 'key', and 'name'
+            None: If there was an issue generating API key
+    """
+    org_id = post_org(name, base_url, auth)
+    if org_id is None:
+        raise OrganizationError(f'Organization {name} not found!')
+    switch_org(org_id, base_url, auth)
+    return create_api_token(key_name, base_url, auth)
+
+
+def main(args:list) -> dict:
+    arguments = parse_arguments(args)
+
+    if arguments.help:
+        help_()
+        exit(0)
+
+    GRAFANA_NAME = arguments.name
+    GRAFANA_USER = arguments.user
+    GRAFANA_PASS = arguments.password
+    GRFANA_HOST = arguments.host
+    GRAFANA_PORT = arguments.port
+    API_KEY_FILE = arguments.file
 
     try: 
         check_arguments(GRAFANA_NAME, GRAFANA_USER, GRAFANA_PASS, GRFANA_HOST, 
                         GRAFANA_PORT, API_KEY_FILE)
-    except MissingArgumentError as error:
-        raise SystemExit(error)
+    except MissingArgumentError as argument_error:
+        raise SystemExit(argument_error)
 
-    api_exists = check_api_key_file(GRAFANA_NAME, API_KEY_FILE)
+    API_KEY_NAME = GRAFANA_NAME
+    BASE_URL = f'http://{GRFANA_HOST}:{GRAFANA_PORT}'
+    AUTH = (GRAFANA_USER, GRAFANA_PASS)
+
+    api_exists = check_api_key_file(API_KEY_NAME, API_KEY_FILE)
 
     if api_exists:
         status = {
@@ -279,37 +410,16 @@ def main(args):
         return status
 
     try:
-        org_id = post_org(GRAFANA_NAME, GRAFANA_USER, GRAFANA_PASS, 
-                          GRFANA_HOST, GRAFANA_PORT)
-    except requests.exceptions.RequestException as error:
-        raise SystemExit(error)
-    except requests.exceptions.RequestException as error:
-        raise SystemExit(error)            
-    except InvalidUsernameOrPasswordError as error:
-        raise SystemExit(error)
-
-    try:
-        switch_org(org_id, GRAFANA_USER, GRAFANA_PASS, GRFANA_HOST,
-                   GRAFANA_PORT)
-    except requests.exceptions.RequestException as error:
-        raise SystemExit(error)
-    except OrganizationError as error:
-        raise SystemExit(error)
-    
-    try:
-        api_key = create_api_token(GRAFANA_NAME, GRAFANA_USER, GRAFANA_PASS,
-                                   GRFANA_HOST, GRAFANA_PORT)
-    except requests.exceptions.RequestException as error:
-        raise SystemExit(error)
-    except CreateAPITokenError as error:
-        raise SystemExit(error)
-
-    with API_KEY_FILE.open('w') as file:
-        json.dump(api_key, file, sort_keys=True, indent=4)
-
-    api_exists = check_api_key_file(GRAFANA_NAME, API_KEY_FILE)
-
-    if api_exists:
+        api_key = provision_api_key(GRAFANA_NAME, API_KEY_NAME, BASE_URL, AUTH)
+    except (requests.exceptions.RequestException,
+            InvalidUsernameOrPasswordError,
+            OrganizationError,
+            CreateAPITokenError) as provisioning_error:
+        raise SystemExit(provisioning_error)
+
+    # The key we write is already in memory, no need to read the file back
+    if api_key and api_key.get('key'):
+        write_api_key_file(api_key, API_KEY_FILE, arguments.pretty)
         status = {
             'success': True,
             'message': 'API key created',
@@ -323,10 +433,15 @@ def main(args):
         return status
 
 
-if __name__ == "__main__":
+def cli() -> None:
+    """Runs main with the command line arguments and exits with its status"""
     status = main(argv[1:])
     print(status['message'])
     if status['success']:
         exit(0)
     else:
         exit(1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,26 @@
+"""
+Builds grafana_utils/api_key_generator.py into a C extension with mypyc
+
+    pip install --no-build-isolation .    (requires mypy and requests)
+
+installs the compiled api_key_generator module and the
+grafana-api-key-generator command. The plain script keeps working without
+this step.
+"""
+
+from setuptools import setup
+from mypyc.build import mypycify
+
+setup(
+    name='grafana_utils',
+    version='0.1.0',
+    python_requires='>=3.9',
+    install_requires=['requests'],
+    extras_require={'orjson': ['orjson']},
+    ext_modules=mypycify(['grafana_utils/api_key_generator.py']),
+    entry_points={
+        'console_scripts': [
+            'grafana-api-key-generator = api_key_generator:cli',
+        ],
+    },
+)